@@ -0,0 +1,187 @@
+"""Offline backtest for the anti-collusion rules.
+
+Replays an export of the `calls` collection against ANTI_COLLUSION_RULES (or
+alternative thresholds) with NumPy/pandas instead of one Mongo query per call,
+and reports flag counts plus seeker-level precision/recall against a label set.
+
+    mongoexport --db $DB_NAME --collection calls --query '{"status":"ended"}' --out calls.jsonl
+    python backtest_anti_collusion.py calls.jsonl --labels colluders.txt \\
+        --grid short_call_threshold=2,3,4 --grid pair_max_calls_per_day=3,5
+
+The replay matches AntiCollusionEngine.observe call for call (calls are
+processed in ended_at order, pair and silence windows reset on the IST day).
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from server import ANTI_COLLUSION_RULES, IST_OFFSET_SECONDS  # noqa: E402
+
+FLAG_TYPES = ["short_call_spam", "pair_overcall", "pair_overminutes", "silence_farming"]
+CALL_FIELDS = ["seeker_id", "listener_id", "duration_seconds", "ended_at"]
+
+
+# ─── LOADING ───────────────────────────────────────────
+def load_calls(path: str) -> pd.DataFrame:
+    """Read a calls export (mongoexport JSON lines, JSON array, CSV or Parquet)."""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        df = pd.read_csv(path, usecols=lambda c: c in CALL_FIELDS + ["status"])
+    elif suffix == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        with open(path) as f:
+            lines = f.read(1).strip() != "["
+        df = pd.read_json(path, lines=lines)
+    if "status" in df.columns:
+        df = df[df["status"] == "ended"]
+    return df[CALL_FIELDS].dropna(subset=["seeker_id", "listener_id", "ended_at"])
+
+
+def load_labels(path: Optional[str]) -> Optional[set]:
+    """One known-colluding user id per line."""
+    if not path:
+        return None
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class PreparedCalls:
+    """Columnar calls in replay order, plus the group codes every rule run reuses."""
+
+    def __init__(self, df: pd.DataFrame):
+        ended = df["ended_at"]
+        if not pd.api.types.is_numeric_dtype(ended):
+            ended = pd.to_datetime(ended, utc=True, format="ISO8601").astype("int64") / 1e9
+        ts = ended.to_numpy(dtype=np.float64)
+        order = np.argsort(ts, kind="stable")  # ended_at order, like the live stream
+        self.ts = ts[order]
+        self.duration = df["duration_seconds"].fillna(0).to_numpy(dtype=np.int64)[order]
+        self.seeker_ids = df["seeker_id"].to_numpy()[order]
+        self.seeker, self.seeker_index = pd.factorize(self.seeker_ids)
+        listener, _ = pd.factorize(df["listener_id"].to_numpy()[order])
+        self.day = ((self.ts + IST_OFFSET_SECONDS) // 86400).astype(np.int64)
+        self.size = len(self.ts)
+
+        # Per-seeker ordering for the sliding short-call window: integer millisecond
+        # keys so (seeker, ts) compares as one sortable int64.
+        ms = np.round(self.ts * 1000).astype(np.int64)
+        self.ms_base = int(ms.min()) if self.size else 0
+        self.ms = ms - self.ms_base
+        self.ms_span = int(self.ms.max()) + 1 if self.size else 1
+        self.by_seeker = np.lexsort((np.arange(self.size), self.seeker))
+        self.seeker_key = self.seeker[self.by_seeker].astype(np.int64) * self.ms_span + self.ms[self.by_seeker]
+
+        # Group codes in replay order: pair-day for pair rules, seeker-day for silence.
+        # Packed into int64 keys (a MultiIndex factorize is ~10x slower).
+        day = self.day - (self.day.min() if self.size else 0)
+        n_days = int(day.max()) + 1 if self.size else 1
+        seeker_day = self.seeker.astype(np.int64) * n_days + day
+        self.seeker_day = pd.factorize(seeker_day)[0]
+        self.pair_day = pd.factorize((seeker_day * (int(listener.max()) + 1 if self.size else 1)) + listener)[0]
+
+
+# ─── RULE REPLAY ───────────────────────────────────────
+def _grouped_cumsum(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    return pd.Series(values).groupby(groups, sort=False).cumsum().to_numpy()
+
+
+def evaluate_rules(calls: PreparedCalls, rules: dict = ANTI_COLLUSION_RULES) -> Dict[str, np.ndarray]:
+    """Boolean flag mask per rule, aligned with the calls in replay order."""
+    r = {**ANTI_COLLUSION_RULES, **rules}
+    d = calls.duration
+
+    # 1. Short call spam: short calls by the seeker in [ended - window, ended]
+    is_short = ((d > 0) & (d < r["short_call_max_seconds"]))[calls.by_seeker]
+    prefix = np.concatenate(([0], np.cumsum(is_short)))
+    window_ms = r["short_call_window_minutes"] * 60 * 1000
+    horizon = calls.seeker_key - np.minimum(calls.ms[calls.by_seeker], window_ms)
+    lo = np.searchsorted(calls.seeker_key, horizon, side="left")
+    in_window = prefix[np.arange(calls.size) + 1] - prefix[lo]
+    short_call_spam = np.empty(calls.size, dtype=bool)
+    short_call_spam[calls.by_seeker] = in_window >= r["short_call_threshold"]
+
+    # 2. Same pair abuse per IST day
+    pair_calls = pd.Series(calls.pair_day).groupby(calls.pair_day, sort=False).cumcount().to_numpy() + 1
+    pair_seconds = _grouped_cumsum(d, calls.pair_day)
+
+    # 3. Silence farming: counted only on calls inside the silence band
+    is_silent = (d > r["silence_min_seconds"]) & (d < r["silence_max_seconds"])
+    silent_count = _grouped_cumsum(is_silent.astype(np.int64), calls.seeker_day)
+
+    return {
+        "short_call_spam": short_call_spam,
+        "pair_overcall": pair_calls > r["pair_max_calls_per_day"],
+        "pair_overminutes": pair_seconds / 60 > r["pair_max_minutes_per_day"],
+        "silence_farming": is_silent & (silent_count >= r["silence_threshold"]),
+    }
+
+
+def summarize(calls: PreparedCalls, flags: Dict[str, np.ndarray], labels: Optional[set] = None) -> dict:
+    """Flag counts per rule, and seeker-level precision/recall when labels are given."""
+    any_flag = np.zeros(calls.size, dtype=bool)
+    for mask in flags.values():
+        any_flag |= mask
+    summary = {f"{name}_calls": int(mask.sum()) for name, mask in flags.items()}
+    summary["flagged_calls"] = int(any_flag.sum())
+    flagged = np.unique(calls.seeker[any_flag])
+    summary["flagged_seekers"] = len(flagged)
+    if labels is not None:
+        is_bad = np.fromiter((s in labels for s in calls.seeker_index), dtype=bool, count=len(calls.seeker_index))
+        hits = int(is_bad[flagged].sum())
+        summary["precision"] = round(hits / len(flagged), 4) if len(flagged) else None
+        summary["recall"] = round(hits / int(is_bad.sum()), 4) if is_bad.any() else None
+    return summary
+
+
+def expand_grid(specs: Iterable[str]) -> List[dict]:
+    """["a=1,2", "b=3"] → [{"a": 1, "b": 3}, {"a": 2, "b": 3}]; keys must be ANTI_COLLUSION_RULES keys."""
+    axes = {}
+    for spec in specs:
+        key, _, values = spec.partition("=")
+        if key not in ANTI_COLLUSION_RULES:
+            raise SystemExit(f"Unknown rule '{key}'. Known: {', '.join(ANTI_COLLUSION_RULES)}")
+        axes[key] = [type(ANTI_COLLUSION_RULES[key])(v) for v in values.split(",")]
+    return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())] or [{}]
+
+
+def run_backtest(df: pd.DataFrame, grid: List[dict], labels: Optional[set] = None) -> pd.DataFrame:
+    calls = PreparedCalls(df)
+    rows = []
+    for overrides in grid:
+        started = time.perf_counter()
+        summary = summarize(calls, evaluate_rules(calls, overrides), labels)
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        rows.append({**overrides, **summary})
+    return pd.DataFrame(rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Backtest anti-collusion thresholds against a calls export")
+    parser.add_argument("calls", help="calls export: .jsonl/.json (mongoexport), .csv or .parquet")
+    parser.add_argument("--labels", help="file with one known-colluding user id per line")
+    parser.add_argument("--grid", action="append", default=[], metavar="RULE=V1,V2",
+                        help="alternative values for an ANTI_COLLUSION_RULES key (repeatable)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    df = load_calls(args.calls)
+    print(f"Loaded {len(df):,} ended calls in {time.perf_counter() - started:.1f}s")
+    result = run_backtest(df, expand_grid(args.grid), load_labels(args.labels))
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(result.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
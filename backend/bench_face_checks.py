@@ -0,0 +1,129 @@
+"""Selfie verification benchmark: one combined Gemini call vs liveness + match in parallel.
+
+Runs --verifications selfie checks through gemini_face_checks (and so through
+the shared GeminiExecutor and its concurrency cap) against a stand-in model
+whose latency grows with images sent and tokens generated, with log-normal
+jitter for the tail. Reports Gemini calls, tokens, cost and latency
+percentiles per verification for each mode. The latency model and prices are
+CLI flags; defaults approximate gemini-1.5-flash (258 tokens per image).
+
+    python bench_face_checks.py --verifications 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import server  # noqa: E402
+
+IMAGE_TOKENS = 258
+
+LIVENESS = {"face_detected": True, "face_count": 1, "is_live_person": True, "liveness_issues": [],
+            "face_confidence": 0.97, "liveness_score": 0.93}
+MATCH = {"face_found_in_id": True, "face_found_in_selfie": True, "is_match": True, "match_score": 0.88,
+         "mismatch_reasons": []}
+ANSWERS = {"liveness": LIVENESS, "face_match": MATCH, "face_verification": {**LIVENESS, **MATCH}}
+
+
+class SimulatedGemini:
+    """Vision backend with token accounting and a size-dependent, jittered delay."""
+
+    model_name = "simulated-gemini"
+    available = True
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = np.random.default_rng(0)
+        self.lock = threading.Lock()
+        self.calls = self.input_tokens = self.output_tokens = 0
+
+    def generate(self, kind: str, prompt: str, images: list) -> str:
+        text = json.dumps(ANSWERS[kind])
+        tokens_in, tokens_out = len(prompt) // 4 + len(images) * IMAGE_TOKENS, len(text) // 4
+        with self.lock:
+            self.calls += 1
+            self.input_tokens += tokens_in
+            self.output_tokens += tokens_out
+            jitter = self.rng.lognormal(0, self.args.jitter)
+        a = self.args
+        time.sleep((a.base_ms + a.image_ms * len(images) + a.output_token_ms * tokens_out) * jitter / 1000)
+        return text
+
+
+class NoCache(server.VisionResultCache):
+    """Every verification must reach the model."""
+
+    async def get(self, key):
+        return None
+
+    async def put(self, key, kind, result, ttl=None):
+        pass
+
+
+async def run_mode(args, combined: bool) -> dict:
+    backend = SimulatedGemini(args)
+    server.vision_backend = backend
+    server.vision_cache = NoCache()
+    server.KYC_COMBINED_FACE_CHECK = combined
+    server.gemini_executor = server.GeminiExecutor(max_concurrency=args.gemini_concurrency)
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def verify(i: int):
+        async with gate:
+            started = time.perf_counter()
+            face, match = await server.gemini_face_checks(f"id-{i}", f"selfie-{i}")
+            assert face["liveness_status"] == "passed" and match["is_match"]
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(verify(i) for i in range(args.verifications)))
+    wall = time.perf_counter() - started
+    server.gemini_executor.pool.shutdown()
+    n = args.verifications
+    cost = (backend.input_tokens * args.input_price + backend.output_tokens * args.output_price) / 1e6
+    return {
+        "calls": backend.calls / n,
+        "input_tokens": backend.input_tokens / n,
+        "output_tokens": backend.output_tokens / n,
+        "usd_per_1k": cost / n * 1000,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "throughput": n / wall,
+    }
+
+
+async def main(args):
+    results = {"separate": await run_mode(args, combined=False), "combined": await run_mode(args, combined=True)}
+    print(f"{args.verifications} verifications, {args.concurrency} concurrent, "
+          f"Gemini executor cap {args.gemini_concurrency}")
+    print(f"{'mode':<9} {'calls':>5} {'in tok':>7} {'out tok':>7} {'$/1k':>7} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'p99 ms':>7} {'verif/s':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<9} {r['calls']:>5.1f} {r['input_tokens']:>7.0f} {r['output_tokens']:>7.0f} "
+              f"{r['usd_per_1k']:>7.3f} {r['p50']:>7.0f} {r['p95']:>7.0f} {r['p99']:>7.0f} {r['throughput']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verifications", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16, help="selfie checks in flight")
+    parser.add_argument("--gemini-concurrency", type=int, default=server.GEMINI_MAX_CONCURRENCY)
+    parser.add_argument("--base-ms", type=float, default=600.0, help="fixed per-call latency")
+    parser.add_argument("--image-ms", type=float, default=150.0, help="added latency per image")
+    parser.add_argument("--output-token-ms", type=float, default=4.0, help="added latency per output token")
+    parser.add_argument("--jitter", type=float, default=0.35, help="sigma of the log-normal latency multiplier")
+    parser.add_argument("--input-price", type=float, default=0.075, help="USD per 1M input tokens")
+    parser.add_argument("--output-price", type=float, default=0.30, help="USD per 1M output tokens")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,168 @@
+"""KYC upload memory benchmark: base64-in-JSON vs streamed uploads.
+
+Starts server.app under uvicorn in a child process (mongomock-motor, local blob
+store in a temp dir, the fake vision backend with a fixed delay), then sends
+--concurrency simultaneous ID uploads of --size-mb each, first to
+/v2/kyc/upload-id as base64 JSON and then to /kyc/upload-id-file as multipart,
+and reports the server's peak RSS growth per in-flight upload.
+
+    python bench_kyc_upload.py --concurrency 20 --size-mb 8
+
+Gemini gets the downscaled JPEG from the preprocessing pool either way; the
+difference is the JSON body, the parsed string and the decoded bytes, none of
+which the streamed path holds (pool workers read the spooled file themselves,
+and their memory is not counted here).
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench_kyc")
+os.environ.setdefault("EVENT_BUS_BACKEND", "local")
+os.environ.setdefault("KYC_BLOB_BACKEND", "local")
+os.environ.setdefault("KYC_BLOB_DIR", tempfile.mkdtemp(prefix="bench-kyc-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+# ─── SERVER SIDE ───────────────────────────────────────
+def serve(port: int, gemini_ms: float):
+    import logging
+    import uvicorn
+    import server
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("bench_kyc_upload needs mongomock-motor (pip install mongomock-motor)")
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+
+    server.vision_backend = server.FakeVisionBackend(latency_ms=gemini_ms)
+
+    @server.app.post("/bench/reset-peak")
+    async def reset_peak():
+        with open(f"/proc/{os.getpid()}/clear_refs", "w") as f:
+            f.write("5")
+        await server.db.kyc_submissions.delete_many({})
+        await server.db.kyc_jobs.delete_many({})
+        return {"rss_kb": proc_kb(os.getpid(), "VmRSS")}
+
+    @server.app.get("/bench/jobs")
+    async def jobs():
+        return {"jobs": await server.db.kyc_jobs.find({}, {"_id": 0, "status": 1}).to_list(None)}
+
+    @server.app.get("/bench/peak")
+    async def peak():
+        return {"hwm_kb": proc_kb(os.getpid(), "VmHWM")}
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def proc_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+# ─── CLIENT SIDE ───────────────────────────────────────
+def noise_jpeg(f, size_mb: float):
+    """A real JPEG of about size_mb (noise compresses poorly), so it passes KYC preprocessing."""
+    import numpy as np
+    from PIL import Image
+    side = int((size_mb * 2**20 / 1.2) ** 0.5)
+    pixels = np.random.default_rng(0).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(f, format="JPEG", quality=95)
+    f.flush()
+
+
+async def round_(http, mode: str, image_path: str, concurrency: int, round_no: int) -> dict:
+    import base64
+    from server import create_token
+
+    headers = [{"Authorization": f"Bearer {create_token(f'bench_{round_no}_{i}', 'listener')}"}
+               for i in range(concurrency)]
+    if mode == "json":
+        body = {"id_type": "pan", "id_image_base64": base64.b64encode(Path(image_path).read_bytes()).decode()}
+
+        def send(h):
+            return http.post("/api/v2/kyc/upload-id", json=body, headers=h)
+    else:
+        def send(h):
+            return http.post("/api/kyc/upload-id-file", data={"id_type": "pan"}, headers=h,
+                             files={"file": ("id.jpg", open(image_path, "rb"), "image/jpeg")})
+
+    admin = {"Authorization": f"Bearer {create_token('bench_admin', 'admin')}"}
+    before = (await http.post("/bench/reset-peak")).json()["rss_kb"]
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(send(h) for h in headers))
+    accepted = time.perf_counter() - started
+    while True:  # uploads only enqueue; include the KYC jobs in the peak
+        jobs = (await http.get("/api/admin/kyc-jobs", headers=admin)).json()
+        if not jobs["queued"] and not jobs["running"]:
+            break
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    peak = (await http.get("/bench/peak")).json()["hwm_kb"]
+    failed = [r.status_code for r in responses if r.status_code != 202]
+    failed += [j["status"] for j in (await http.get("/bench/jobs")).json()["jobs"] if j["status"] != "done"]
+    return {"peak_mb": (peak - before) / 1024, "per_upload_mb": (peak - before) / 1024 / concurrency,
+            "accepted": accepted, "seconds": elapsed, "failed": failed}
+
+
+async def main(args):
+    import logging
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, __file__, "serve", "--port", str(port),
+                             "--gemini-ms", str(args.gemini_ms)])
+    http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600)
+    try:
+        for _ in range(300):
+            try:
+                await http.get("/api/")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as image:
+            noise_jpeg(image, args.size_mb)
+            print(f"{args.concurrency} concurrent uploads of {os.path.getsize(image.name) / 2**20:.1f} MB, "
+                  f"fake Gemini {args.gemini_ms:g} ms")
+            for round_no, mode in enumerate(("json", "stream", "json", "stream")):  # second pass: warmed allocator
+                r = await round_(http, mode, image.name, args.concurrency, round_no)
+                print(f"{mode:<7}: peak +{r['peak_mb']:7.1f} MB  ({r['per_upload_mb']:5.1f} MB/upload)  "
+                      f"accepted in {r['accepted']:.2f}s, verified in {r['seconds']:.2f}s  failed={r['failed'] or 0}")
+    finally:
+        await http.aclose()
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_args = argparse.ArgumentParser()
+        serve_args.add_argument("serve")
+        serve_args.add_argument("--port", type=int, default=8002)
+        serve_args.add_argument("--gemini-ms", type=float, default=500.0)
+        parsed = serve_args.parse_args()
+        serve(parsed.port, parsed.gemini_ms)
+    else:
+        parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--size-mb", type=float, default=8.0)
+        parser.add_argument("--gemini-ms", type=float, default=500.0, help="fake vision call duration")
+        asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+"""Push throughput benchmark against a local fake Expo endpoint.
+
+Starts a fake Expo push API on localhost (with a configurable per-request
+latency standing in for the network round trip) and compares:
+  legacy:  one HTTPS request per notification, new client each time
+  batched: ExpoPushSender (batches of 100, concurrent senders, shared client)
+
+    python bench_push.py --messages 5000 --latency-ms 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import server  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def fake_expo_app(latency: float) -> FastAPI:
+    fake = FastAPI()
+    fake.state.received = 0
+
+    @fake.post("/--/api/v2/push/send")
+    async def push_send(request: Request):
+        body = await request.json()
+        messages = body if isinstance(body, list) else [body]
+        if len(messages) > server.PUSH_BATCH_SIZE:
+            return {"errors": [{"code": "PUSH_TOO_MANY_NOTIFICATIONS"}]}
+        await asyncio.sleep(latency)
+        fake.state.received += len(messages)
+        return {"data": [{"status": "ok", "id": str(i)} for i in range(len(messages))]}
+    return fake
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def legacy_send(url: str, messages: list):
+    """The previous send_expo_push: one request and one client per notification, awaited in turn."""
+    for m in messages:
+        async with httpx.AsyncClient(timeout=10.0) as http_client:
+            await http_client.post(url, json=m)
+
+
+async def batched_send(url: str, messages: list, concurrency: int):
+    sender = server.ExpoPushSender(url=url, queue_max=len(messages) + 1, concurrency=concurrency)
+    await sender.start()
+    for m in messages:
+        sender.enqueue(m)
+    await sender.stop()
+    return sender.stats
+
+
+async def main(args):
+    fake = fake_expo_app(args.latency_ms / 1000)
+    port = free_port()
+    config = uvicorn.Config(fake, host="127.0.0.1", port=port, log_level="warning")
+    uv = uvicorn.Server(config)
+    serve = asyncio.create_task(uv.serve())
+    while not uv.started:
+        await asyncio.sleep(0.01)
+    url = f"http://127.0.0.1:{port}/--/api/v2/push/send"
+    messages = [{"to": f"ExponentPushToken[bench{i}]", "sound": "default", "title": "t", "body": "b", "data": {}}
+                for i in range(args.messages)]
+
+    legacy_n = min(args.messages, args.legacy_messages)
+    started = time.perf_counter()
+    await legacy_send(url, messages[:legacy_n])
+    legacy = legacy_n / (time.perf_counter() - started)
+    print(f"legacy : {legacy_n:>6} msgs  {legacy:>9.0f} msg/s")
+
+    started = time.perf_counter()
+    stats = await batched_send(url, messages, args.concurrency)
+    batched = args.messages / (time.perf_counter() - started)
+    print(f"batched: {args.messages:>6} msgs  {batched:>9.0f} msg/s  "
+          f"({stats['batches']} batches, {stats['failed']} failed)  x{batched / legacy:.0f}")
+
+    uv.should_exit = True
+    await serve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--legacy-messages", type=int, default=200, help="legacy is slow; time a sample")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated Expo round trip")
+    parser.add_argument("--concurrency", type=int, default=server.PUSH_SENDER_CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,194 @@
+"""KYC load test: full listener verifications against one local worker, offline.
+
+Starts server.app under uvicorn in a child process with VISION_BACKEND=fake and
+VISION_ALLOW_FAKE=1 (no Gemini, no network), mongomock-motor and a local blob
+store in a temp dir, then runs --listeners verifications, --concurrency at a
+time, through the real path: /kyc/upload-id-file → OCR job →
+/kyc/confirm-id-data → /kyc/upload-selfie-file → liveness + face-match job.
+Every listener uploads its own images, so the vision result cache never
+short-circuits a call.
+Reports verifications per second, per-step and end-to-end latency
+percentiles, failures by reason, and the server's Gemini executor counters.
+
+    python loadtest_kyc.py --listeners 200 --concurrency 40
+    python loadtest_kyc.py --latency-ms 1500 --failure-rate 0.05 --job-concurrency 8
+
+The fake's latency, jitter and failure rate are the VISION_FAKE_* settings of
+the child server; see FakeVisionBackend in server.py.
+"""
+import argparse
+import asyncio
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "loadtest_kyc")
+os.environ.setdefault("EVENT_BUS_BACKEND", "local")
+os.environ.setdefault("KYC_BLOB_BACKEND", "local")
+os.environ.setdefault("KYC_BLOB_DIR", tempfile.mkdtemp(prefix="loadtest-kyc-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+# ─── SERVER SIDE ───────────────────────────────────────
+def serve(port: int):
+    import logging
+    import uvicorn
+    import server
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("loadtest_kyc needs mongomock-motor (pip install mongomock-motor)")
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+
+    @server.app.get("/loadtest/vision")
+    async def vision():
+        return {"backend": server.vision_backend.model_name, "calls": getattr(server.vision_backend, "calls", None)}
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# ─── CLIENT SIDE ───────────────────────────────────────
+def photo(seed: int, width: int = 960, height: int = 720) -> bytes:
+    """Blocky noise as a JPEG: sharp enough for KYC preprocessing, different per seed."""
+    import numpy as np
+    from PIL import Image
+    blocks = np.random.default_rng(seed).integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(blocks).resize((width, height), Image.NEAREST).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+async def wait_for_job(http, headers: dict, job: dict, poll: float) -> dict:
+    """Poll /kyc/status?job_id= (what the app does when the socket is down) until the job settles."""
+    while job["status"] in ("queued", "running"):
+        await asyncio.sleep(poll)
+        job = (await http.get("/api/kyc/status", params={"job_id": job["job_id"]}, headers=headers)).json()["job"]
+    return job
+
+
+async def verify_listener(http, i: int, args, steps: dict) -> str:
+    """One listener from ID upload to a final verdict; returns "verified" or a failure reason."""
+    from server import create_token
+
+    headers = {"Authorization": f"Bearer {create_token(f'loadtest_kyc_{i}', 'listener')}"}
+    started = time.perf_counter()
+    r = await http.post("/api/kyc/upload-id-file", data={"id_type": "pan"}, headers=headers,
+                        files={"file": ("id.jpg", photo(2 * i), "image/jpeg")})
+    if r.status_code != 202:
+        return f"upload-id {r.status_code}"
+    job = await wait_for_job(http, headers, r.json(), args.poll)
+    steps["id"].append(time.perf_counter() - started)
+    if job["status"] != "done":
+        return f"id job {job['status']}: {job.get('error')}"
+
+    r = await http.post("/api/kyc/confirm-id-data", headers=headers)
+    if r.status_code != 200:
+        return f"confirm {r.status_code}"
+
+    selfie_started = time.perf_counter()
+    r = await http.post("/api/kyc/upload-selfie-file", headers=headers,
+                        files={"file": ("selfie.jpg", photo(2 * i + 1), "image/jpeg")})
+    if r.status_code != 202:
+        return f"upload-selfie {r.status_code}"
+    job = await wait_for_job(http, headers, r.json(), args.poll)
+    steps["selfie"].append(time.perf_counter() - selfie_started)
+    if job["status"] != "done":
+        return f"selfie job {job['status']}: {job.get('error')}"
+
+    status = (await http.get("/api/kyc/status", headers=headers)).json()["status"]
+    steps["total"].append(time.perf_counter() - started)
+    return status
+
+
+async def main(args):
+    import logging
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, "VISION_BACKEND": "fake", "VISION_ALLOW_FAKE": "1",
+           "VISION_FAKE_LATENCY_MS": str(args.latency_ms), "VISION_FAKE_IMAGE_LATENCY_MS": str(args.image_latency_ms),
+           "VISION_FAKE_JITTER": str(args.jitter),
+           "VISION_FAKE_FAILURE_RATE": str(args.failure_rate), "VISION_FAKE_SEED": str(args.seed),
+           "KYC_JOB_CONCURRENCY": str(args.job_concurrency)}
+    proc = subprocess.Popen([sys.executable, __file__, "serve", "--port", str(port)], env=env)
+    http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600)
+    try:
+        for _ in range(300):
+            try:
+                await http.get("/api/")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        steps = {"id": [], "selfie": [], "total": []}
+        gate = asyncio.Semaphore(args.concurrency)
+
+        async def one(i: int) -> str:
+            async with gate:
+                return await verify_listener(http, i, args, steps)
+
+        started = time.perf_counter()
+        outcomes = Counter(await asyncio.gather(*(one(i) for i in range(args.listeners))))
+        elapsed = time.perf_counter() - started
+        from server import create_token
+        admin = {"Authorization": f"Bearer {create_token('loadtest_admin', 'admin')}"}
+        stats = (await http.get("/api/admin/kyc-jobs", headers=admin)).json()
+        vision = (await http.get("/loadtest/vision")).json()
+    finally:
+        await http.aclose()
+        proc.terminate()
+        proc.wait()
+
+    print(f"{args.listeners} listeners, {args.concurrency} concurrent, {args.job_concurrency} KYC jobs per worker; "
+          f"fake vision {args.latency_ms:g} ms + {args.image_latency_ms:g} ms/image, "
+          f"jitter {args.jitter:g}, failure rate {args.failure_rate:g}")
+    print(f"verified {outcomes.get('verified', 0)}/{args.listeners} in {elapsed:.1f}s "
+          f"({outcomes.get('verified', 0) / elapsed:.2f} verifications/s)")
+    for step, values in steps.items():
+        p = percentiles(values)
+        print(f"{step:<7} p50 {p['p50']:6.2f}s  p95 {p['p95']:6.2f}s  p99 {p['p99']:6.2f}s  (n={len(values)})")
+    for outcome, count in outcomes.most_common():
+        if outcome != "verified":
+            print(f"failed  {count:>5}  {outcome}")
+    print(f"vision backend {stats['vision_backend']}, calls {vision['calls']}, job runner {stats['stats']}, gemini {stats['gemini']}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_args = argparse.ArgumentParser()
+        serve_args.add_argument("serve")
+        serve_args.add_argument("--port", type=int, default=8003)
+        serve(serve_args.parse_args().port)
+    else:
+        parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+        parser.add_argument("--listeners", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=20, help="listeners verifying at once")
+        parser.add_argument("--job-concurrency", type=int, default=4, help="KYC_JOB_CONCURRENCY of the server")
+        parser.add_argument("--latency-ms", type=float, default=800.0, help="fixed fake vision call latency")
+        parser.add_argument("--image-latency-ms", type=float, default=150.0, help="added latency per image")
+        parser.add_argument("--jitter", type=float, default=0.3, help="sigma of the log-normal latency multiplier")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="share of vision calls that raise")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--poll", type=float, default=0.2, help="job status poll interval (seconds)")
+        asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,243 @@
+"""WebSocket load test: thousands of concurrent /ws sessions against one local worker.
+
+Starts server.app under uvicorn in a child process with an in-memory Mongo
+stand-in (mongomock-motor) and the local event bus, mints JWTs with
+create_token, opens --sessions concurrent clients (half listeners, half
+seekers) and drives incoming_call / call_accepted / call_rejected storms
+through _ws_push. Reports server RSS per session, push-to-receive latency
+percentiles, _ws_push call time in the server and dropped events.
+
+    python loadtest_ws.py --sessions 10000 --rounds 5
+    python loadtest_ws.py --mongo-url mongodb://localhost:27017   # real mongod instead of the stand-in
+    python loadtest_ws.py --url ws://127.0.0.1:8001 ...   # against a server started with `serve`
+
+mongomock-motor is a test-only dependency: pip install mongomock-motor. It scans
+collections linearly, so with it _ws_push time (the ws_sequences $inc) grows with
+the session count; pass --mongo-url for storm numbers that reflect production.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "loadtest")
+os.environ.setdefault("EVENT_BUS_BACKEND", "local")
+os.environ.setdefault("KYC_BLOB_BACKEND", "local")  # no KYC traffic; only has to pass the startup check
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+# ─── SERVER SIDE ───────────────────────────────────────
+def serve(port: int, mongo_url: str = ""):
+    """Run server.app (on mongomock unless mongo_url), plus storm endpoints only this process exposes."""
+    import logging
+    import uvicorn
+    from pydantic import BaseModel
+    from typing import List
+    import server
+
+    if mongo_url:
+        server.client = server.AsyncIOMotorClient(mongo_url)
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("loadtest_ws needs mongomock-motor (pip install mongomock-motor) or --mongo-url")
+        server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+    push_ms: list = []
+
+    class StormRequest(BaseModel):
+        user_ids: List[str]
+        event: str
+
+    @server.app.post("/loadtest/storm")
+    async def storm(req: StormRequest):
+        for user_id in req.user_ids:
+            started = time.perf_counter()
+            await server._ws_push(user_id, {"event": req.event, "call_id": server.uid(), "sent_at": time.time()})
+            push_ms.append((time.perf_counter() - started) * 1000)
+        return {"pushed": len(req.user_ids)}
+
+    @server.app.get("/loadtest/stats")
+    async def stats():
+        return {"push_ms": push_ms, "websockets": server.ws_manager.stats(), "rss_kb": rss_kb(os.getpid())}
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning", ws_max_size=65536)
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+# ─── CLIENT SIDE ───────────────────────────────────────
+class Session:
+    def __init__(self, user_id: str, role: str, token: str):
+        self.user_id = user_id
+        self.role = role
+        self.token = token
+        self.received = 0
+        self.latencies_ms: list = []
+        self.closed_code = None
+
+
+async def run_session(base: str, session: Session, connected: asyncio.Event, stop: asyncio.Event,
+                      handshake: asyncio.Semaphore, ping_every: float):
+    import websockets
+    async with handshake:
+        ws = await websockets.connect(f"{base}/ws/{session.user_id}?token={session.token}",
+                                      ping_interval=None, open_timeout=60, max_queue=None)
+    connected.set()
+
+    async def pinger():
+        while True:
+            await asyncio.sleep(ping_every)
+            await ws.send("ping")
+
+    ping_task = asyncio.create_task(pinger())
+    try:
+        while not stop.is_set():
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not msg.startswith("{"):
+                continue
+            event = json.loads(msg)
+            if "sent_at" in event:
+                session.latencies_ms.append((time.time() - event["sent_at"]) * 1000)
+                session.received += 1
+                await ws.send(json.dumps({"type": "ack", "seq": event["seq"]}))
+    except websockets.ConnectionClosed as e:
+        session.closed_code = e.rcvd.code if e.rcvd else None
+    finally:
+        ping_task.cancel()
+        await ws.close()
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p * len(values)))], 1)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1], 1)}
+
+
+def raise_fd_limit(needed: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, needed), hard))
+    if min(hard, needed) < needed:
+        print(f"warning: open-file limit {hard} < {needed}; raise `ulimit -n` for this many sessions")
+
+
+async def main(args):
+    import logging
+    import httpx
+    from server import create_token
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    raise_fd_limit(args.sessions * 2 + 256)
+    proc = None
+    if args.url:
+        base = args.url.rstrip("/")
+    else:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        proc = subprocess.Popen([sys.executable, __file__, "serve", "--port", str(port),
+                                 "--mongo-url", args.mongo_url or ""])
+        base = f"ws://127.0.0.1:{port}"
+    http_base = base.replace("ws://", "http://", 1)
+    http = httpx.AsyncClient(base_url=http_base, timeout=600)
+    for _ in range(300):
+        try:
+            await http.get("/api/")
+            break
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+
+    sessions = [Session(f"lt_{i}", "listener" if i % 2 == 0 else "seeker", "") for i in range(args.sessions)]
+    for s in sessions:
+        s.token = create_token(s.user_id, s.role)
+    baseline_kb = (await http.get("/loadtest/stats")).json()["rss_kb"]
+
+    stop = asyncio.Event()
+    handshake = asyncio.Semaphore(args.handshake_concurrency)
+    connected = [asyncio.Event() for _ in sessions]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(run_session(base, s, c, stop, handshake, args.ping_every))
+             for s, c in zip(sessions, connected)]
+    await asyncio.gather(*(c.wait() for c in connected))
+    connect_s = time.perf_counter() - started
+    await asyncio.sleep(1)
+    connected_kb = (await http.get("/loadtest/stats")).json()["rss_kb"]
+
+    listeners = [s.user_id for s in sessions if s.role == "listener"]
+    seekers = [s.user_id for s in sessions if s.role == "seeker"]
+    expected = {s.user_id: 0 for s in sessions}
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        # incoming_call to every listener, then accept/reject to the seekers
+        storms = [("incoming_call", listeners), ("call_accepted", seekers[::2]), ("call_rejected", seekers[1::2])]
+        await asyncio.gather(*(
+            http.post("/loadtest/storm", json={"user_ids": ids[i:i + args.batch], "event": event})
+            for event, ids in storms for i in range(0, len(ids), args.batch)
+        ))
+        for _, ids in storms:
+            for user_id in ids:
+                expected[user_id] += 1
+    storm_s = time.perf_counter() - started
+    await asyncio.sleep(args.drain)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    server_stats = (await http.get("/loadtest/stats")).json()
+    await http.aclose()
+    if proc:
+        proc.terminate()
+        proc.wait()
+
+    pushed = sum(expected.values())
+    received = sum(s.received for s in sessions)
+    latencies = [v for s in sessions for v in s.latencies_ms]
+    print(f"sessions          : {args.sessions:,} connected in {connect_s:.1f}s")
+    print(f"server RSS        : {baseline_kb / 1024:.0f} MB idle -> {connected_kb / 1024:.0f} MB connected "
+          f"({(connected_kb - baseline_kb) / args.sessions:.1f} KB/session)")
+    print(f"events pushed     : {pushed:,} in {storm_s:.1f}s ({pushed / max(storm_s, 1e-9):,.0f}/s)")
+    print(f"push->receive ms  : {percentiles(latencies)}")
+    print(f"_ws_push call ms  : {percentiles(server_stats['push_ms'])}")
+    print(f"dropped events    : {pushed - received:,} ({(pushed - received) / max(pushed, 1):.2%})")
+    print(f"evicted sessions  : {server_stats['websockets']['evictions']}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_args = argparse.ArgumentParser()
+        serve_args.add_argument("serve")
+        serve_args.add_argument("--port", type=int, default=8001)
+        serve_args.add_argument("--mongo-url", default="")
+        parsed = serve_args.parse_args()
+        serve(parsed.port, parsed.mongo_url)
+    else:
+        parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+        parser.add_argument("--sessions", type=int, default=2000)
+        parser.add_argument("--rounds", type=int, default=3, help="storm rounds (every session gets one event per round)")
+        parser.add_argument("--batch", type=int, default=500, help="user ids per storm request")
+        parser.add_argument("--handshake-concurrency", type=int, default=200)
+        parser.add_argument("--ping-every", type=float, default=30.0)
+        parser.add_argument("--drain", type=float, default=3.0, help="seconds to wait for in-flight events")
+        parser.add_argument("--url", help="ws://host:port of a running `loadtest_ws.py serve` (default: start one)")
+        parser.add_argument("--mongo-url", help="real Mongo for the started server (default: mongomock)")
+        asyncio.run(main(parser.parse_args()))
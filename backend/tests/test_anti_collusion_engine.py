@@ -0,0 +1,87 @@
+import os
+import sys
+from pathlib import Path
+
+# Anti-collusion engine unit tests: in-memory sliding windows (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+T0 = 1_760_000_000.0  # fixed epoch, mid-day IST
+
+
+def flag_types(flags):
+    return [f["type"] for f in flags]
+
+
+class TestShortCallSpam:
+    """3 calls < 60 sec within 15 min"""
+
+    def test_third_short_call_flags(self):
+        engine = server.AntiCollusionEngine()
+        assert engine.observe("TEST_s", "TEST_l1", 40, T0) == []
+        assert engine.observe("TEST_s", "TEST_l2", 40, T0 + 60) == []
+        assert "short_call_spam" in flag_types(engine.observe("TEST_s", "TEST_l3", 40, T0 + 120))
+
+    def test_window_slides(self):
+        engine = server.AntiCollusionEngine()
+        engine.observe("TEST_s", "TEST_l1", 40, T0)
+        engine.observe("TEST_s", "TEST_l2", 40, T0 + 60)
+        # first short call has left the 15 min window
+        flags = engine.observe("TEST_s", "TEST_l3", 40, T0 + 16 * 60)
+        assert "short_call_spam" not in flag_types(flags)
+
+
+class TestPairRules:
+    """>3 calls/day or >60 min/day with the same listener"""
+
+    def test_fourth_pair_call_flags_overcall(self):
+        engine = server.AntiCollusionEngine()
+        for i in range(3):
+            assert "pair_overcall" not in flag_types(engine.observe("TEST_s", "TEST_l", 600, T0 + i * 3600))
+        assert "pair_overcall" in flag_types(engine.observe("TEST_s", "TEST_l", 600, T0 + 3 * 3600))
+
+    def test_pair_minutes(self):
+        engine = server.AntiCollusionEngine()
+        assert engine.observe("TEST_s", "TEST_l", 3000, T0) == []
+        assert "pair_overminutes" in flag_types(engine.observe("TEST_s", "TEST_l", 900, T0 + 3600))
+
+    def test_pair_resets_on_new_ist_day(self):
+        engine = server.AntiCollusionEngine()
+        engine.observe("TEST_s", "TEST_l", 3000, T0)
+        assert engine.observe("TEST_s", "TEST_l", 900, T0 + 86400) == []
+
+    def test_custom_thresholds(self):
+        rules = {**server.ANTI_COLLUSION_RULES, "pair_max_calls_per_day": 1}
+        engine = server.AntiCollusionEngine(rules)
+        engine.observe("TEST_s", "TEST_l", 600, T0)
+        assert "pair_overcall" in flag_types(engine.observe("TEST_s", "TEST_l", 600, T0 + 3600))
+
+
+class TestSilenceFarming:
+    """Repeated 5-30 sec calls in one day"""
+
+    def test_third_silence_call_flags(self):
+        engine = server.AntiCollusionEngine()
+        engine.observe("TEST_s", "TEST_l1", 20, T0)
+        engine.observe("TEST_s", "TEST_l2", 20, T0 + 3600)
+        assert "silence_farming" in flag_types(engine.observe("TEST_s", "TEST_l3", 20, T0 + 7200))
+
+
+class TestSnapshot:
+    """One bounded document per worker"""
+
+    def test_top_pairs_only(self, monkeypatch):
+        monkeypatch.setattr(server, "ANTI_COLLUSION_SNAPSHOT_TOP_PAIRS", 2)
+        engine = server.AntiCollusionEngine()
+        for i in range(5):
+            engine.observe(f"TEST_s{i}", "TEST_l", 300, T0)
+        for _ in range(3):
+            engine.observe("TEST_s9", "TEST_l", 300, T0)
+        snap = engine.snapshot()
+        assert snap["pairs_tracked"] == 6
+        assert len(snap["top_pairs"]) == 2
+        assert snap["top_pairs"][0] == {"seeker_id": "TEST_s9", "listener_id": "TEST_l", "calls": 3, "seconds": 900}
@@ -0,0 +1,78 @@
+import os
+import random
+import sys
+from pathlib import Path
+
+# Backtest parity: the vectorized replay must raise exactly what AntiCollusionEngine raises
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd  # noqa: E402
+
+import backtest_anti_collusion as backtest  # noqa: E402
+import server  # noqa: E402
+
+T0 = 1_760_000_000.0
+
+
+def random_calls(n=3000, seed=7):
+    rng = random.Random(seed)
+    ts, rows = T0, []
+    for _ in range(n):
+        ts += rng.expovariate(1 / 30)
+        rows.append({
+            "seeker_id": f"TEST_s{rng.randint(0, 40)}",
+            "listener_id": f"TEST_l{rng.randint(0, 8)}",
+            "duration_seconds": rng.choice([0, 4, 12, 25, 45, 59, 60, 600, 2400]),
+            "ended_at": ts,
+        })
+    return rows
+
+
+def engine_counts(rows, rules):
+    engine = server.AntiCollusionEngine({**server.ANTI_COLLUSION_RULES, **rules})
+    counts = dict.fromkeys(backtest.FLAG_TYPES, 0)
+    for c in rows:
+        for f in engine.observe(c["seeker_id"], c["listener_id"], c["duration_seconds"], c["ended_at"]):
+            counts[f["type"]] += 1
+    return counts
+
+
+class TestReplayParity:
+    """Flag counts per rule match the online engine"""
+
+    def test_default_rules(self):
+        rows = random_calls()
+        flags = backtest.evaluate_rules(backtest.PreparedCalls(pd.DataFrame(rows)))
+        assert {k: int(v.sum()) for k, v in flags.items()} == engine_counts(rows, {})
+
+    def test_alternative_thresholds(self):
+        rows = random_calls(seed=11)
+        rules = {"short_call_threshold": 2, "pair_max_calls_per_day": 1, "silence_threshold": 2}
+        flags = backtest.evaluate_rules(backtest.PreparedCalls(pd.DataFrame(rows)), rules)
+        assert {k: int(v.sum()) for k, v in flags.items()} == engine_counts(rows, rules)
+
+    def test_iso_timestamps_and_unsorted_input(self):
+        rows = random_calls(n=500)
+        df = pd.DataFrame(rows).sample(frac=1, random_state=3)
+        df["ended_at"] = pd.to_datetime(df["ended_at"], unit="s", utc=True).map(lambda d: d.isoformat())
+        flags = backtest.evaluate_rules(backtest.PreparedCalls(df))
+        assert {k: int(v.sum()) for k, v in flags.items()} == engine_counts(rows, {})
+
+
+class TestSummary:
+    def test_precision_and_recall(self):
+        rows = [{"seeker_id": "TEST_bad", "listener_id": "TEST_l", "duration_seconds": 20, "ended_at": T0 + i * 60}
+                for i in range(3)]
+        rows.append({"seeker_id": "TEST_ok", "listener_id": "TEST_l", "duration_seconds": 600, "ended_at": T0})
+        result = backtest.run_backtest(pd.DataFrame(rows), [{}], labels={"TEST_bad"})
+        assert result.loc[0, "flagged_seekers"] == 1
+        assert result.loc[0, "precision"] == 1.0
+        assert result.loc[0, "recall"] == 1.0
+
+    def test_grid_expansion(self):
+        grid = backtest.expand_grid(["short_call_threshold=2,3", "pair_max_calls_per_day=5"])
+        assert grid == [{"short_call_threshold": 2, "pair_max_calls_per_day": 5},
+                        {"short_call_threshold": 3, "pair_max_calls_per_day": 5}]
@@ -0,0 +1,137 @@
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Blob store unit tests: content addressing on the local backend and an in-memory S3 client (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import server  # noqa: E402
+
+
+class FakeS3:
+    """The handful of boto3 S3 client calls S3BlobStore uses."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.puts = 0
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.puts += 1
+        self.objects[(Bucket, Key)] = Body
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket, Key, f.read())
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def stores(tmp_path):
+    return [server.LocalBlobStore(tmp_path), server.S3BlobStore(bucket="TEST", client=FakeS3())]
+
+
+async def collect(aiter):
+    return b"".join([chunk async for chunk in aiter])
+
+
+class TestBlobStore:
+    """Both backends behave the same"""
+
+    def test_round_trip_and_ref(self, tmp_path):
+        for store in stores(tmp_path):
+            async def run():
+                ref = await store.put(b"TEST image bytes")
+                return ref, await store.get(ref), await collect(store.stream(ref, chunk_size=4))
+
+            ref, data, streamed = asyncio.run(run())
+            assert ref == server.blob_ref(b"TEST image bytes")
+            assert ref.startswith("sha256:")
+            assert data == streamed == b"TEST image bytes"
+
+    def test_identical_content_stored_once(self, tmp_path):
+        local = server.LocalBlobStore(tmp_path)
+        s3 = server.S3BlobStore(bucket="TEST", client=FakeS3())
+
+        async def run():
+            for store in (local, s3):
+                assert await store.put(b"same") == await store.put(b"same")
+
+        asyncio.run(run())
+        assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+        assert s3.s3.puts == 1
+
+    def test_missing_and_delete(self, tmp_path):
+        for store in stores(tmp_path):
+            async def run():
+                ref = await store.put(b"gone soon")
+                await store.delete(ref)
+                assert not await store.exists(ref)
+                with pytest.raises(KeyError):
+                    await store.get(ref)
+
+            asyncio.run(run())
+
+    def test_rejects_malformed_refs(self, tmp_path):
+        store = server.LocalBlobStore(tmp_path)
+        with pytest.raises(ValueError):
+            asyncio.run(store.get("sha256:../../etc/passwd"))
+
+    def test_missing_id_image_asks_for_reupload(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(server, "blob_store", server.LocalBlobStore(tmp_path))
+        kyc = {"user_id": "TEST_user", "id_image_ref": server.blob_ref(b"TEST never stored")}
+        with pytest.raises(server.HTTPException) as e:
+            asyncio.run(server.load_kyc_id_image(kyc))
+        assert e.value.status_code == 400
+
+    def test_backend_must_be_configured(self):
+        server.check_blob_store_config("s3")
+        server.check_blob_store_config("local")
+        with pytest.raises(RuntimeError):
+            server.check_blob_store_config("")
+
+
+class TestBlobSpool:
+    """Streamed uploads: hashed while written, capped, handed to the store without a copy in memory"""
+
+    def test_commit_matches_put(self, tmp_path):
+        for store in stores(tmp_path / "store"):
+            spool = server.BlobSpool(1024, tmp_path / "spool")
+            for chunk in (b"TEST ", b"image ", b"bytes"):
+                spool.write(chunk)
+            ref = asyncio.run(spool.commit(store))
+            assert ref == server.blob_ref(b"TEST image bytes")
+            assert asyncio.run(store.get(ref)) == b"TEST image bytes"
+            assert not os.path.exists(spool.path)
+
+    def test_size_limit(self, tmp_path):
+        spool = server.BlobSpool(8, tmp_path)
+        spool.write(b"12345678")
+        with pytest.raises(server.HTTPException) as e:
+            spool.write(b"9")
+        assert e.value.status_code == 413
+        spool.discard()
+        assert list(tmp_path.iterdir()) == []
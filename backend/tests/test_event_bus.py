@@ -0,0 +1,158 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Event bus unit tests: in-memory transport, several buses standing in for workers (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+def make_workers(n=2):
+    transport = server.LocalEventTransport()
+    return [server.EventBus(transport, worker_id=f"TEST_w{i}") for i in range(n)]
+
+
+async def run_workers(buses, body):
+    tasks = [asyncio.create_task(bus.run()) for bus in buses]
+    await asyncio.sleep(0)  # let every listener subscribe
+    try:
+        await body()
+        await asyncio.sleep(0.01)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class TestEventBus:
+    """Events reach the other workers, never the origin"""
+
+    def test_other_workers_receive(self):
+        buses = make_workers(3)
+        received = {bus.worker_id: [] for bus in buses}
+        for bus in buses:
+            bus.on("ping")(lambda data, w=bus.worker_id: _record(received[w], data))
+
+        asyncio.run(run_workers(buses, lambda: buses[0].publish("ping", {"n": 1})))
+        assert received == {"TEST_w0": [], "TEST_w1": [{"n": 1}], "TEST_w2": [{"n": 1}]}
+
+    def test_latency_is_measured(self):
+        a, b = make_workers()
+        b.on("ping")(lambda data: _record([], data))
+
+        async def body():
+            for i in range(10):
+                await a.publish("ping", {"n": i})
+
+        asyncio.run(run_workers([a, b], body))
+        stats = b.stats()
+        assert stats["received"] == 10
+        assert stats["latency_ms"]["samples"] == 10
+        assert stats["latency_ms"]["p50"] is not None
+
+    def test_handler_errors_are_counted(self):
+        a, b = make_workers()
+
+        async def boom(data):
+            raise RuntimeError("boom")
+        b.on("ping")(boom)
+
+        asyncio.run(run_workers([a, b], lambda: a.publish("ping", {})))
+        assert b.stats()["failed"] == 1
+
+
+class TestCrossWorkerPush:
+    """_ws_push reaches the worker holding the socket and every worker's replay log"""
+
+    def test_push_published_when_socket_is_elsewhere(self, monkeypatch):
+        origin, owner = make_workers()
+        delivered = []
+        owner.on("ws")(lambda data: _record(delivered, data))
+        monkeypatch.setattr(server, "event_bus", origin)
+        monkeypatch.setattr(server, "_next_ws_seq", _fixed_seq(7))
+
+        asyncio.run(run_workers([origin, owner], lambda: server._ws_push("TEST_remote", {"event": "incoming_call"})))
+        assert delivered == [{"user_id": "TEST_remote", "payload": {"event": "incoming_call", "seq": 7}}]
+
+    def test_local_socket_is_sent_directly(self, monkeypatch):
+        sent = []
+
+        class FakeSocket:
+            async def send_text(self, text):
+                sent.append(text)
+
+        origin, owner = make_workers()
+        monkeypatch.setattr(server, "event_bus", origin)
+        monkeypatch.setattr(server, "_next_ws_seq", _fixed_seq(1))
+        monkeypatch.setattr(server, "ws_manager", server.ConnectionManager())
+
+        async def body():
+            server.ws_manager.register("TEST_local", FakeSocket())
+            await server._ws_push("TEST_local", {"event": "call_accepted"})
+
+        asyncio.run(run_workers([origin, owner], body))
+        assert sent == ['{"event":"call_accepted","seq":1}']
+        assert origin.stats()["published"] == 1  # still published, for the other workers' replay logs
+
+
+class TestReplayLog:
+    """WsEventLog: replay after a sequence, acks, bounds"""
+
+    def test_replays_after_last_seq(self):
+        log = server.WsEventLog()
+        for seq in range(1, 6):
+            log.append("TEST_u", seq, {"seq": seq}, ts=100.0)
+        events, gap = log.since("TEST_u", 3, ts=100.0)
+        assert [e["seq"] for e in events] == [4, 5]
+        assert not gap
+
+    def test_ack_trims_and_is_default_position(self):
+        log = server.WsEventLog()
+        for seq in range(1, 4):
+            log.append("TEST_u", seq, {"seq": seq}, ts=100.0)
+        log.ack("TEST_u", 2)
+        assert [e[0] for e in log.logs["TEST_u"]] == [3]
+        events, _ = log.since("TEST_u", None, ts=100.0)
+        assert [e["seq"] for e in events] == [3]
+
+    def test_gap_when_events_were_evicted(self):
+        log = server.WsEventLog(max_events=2)
+        for seq in range(1, 6):
+            log.append("TEST_u", seq, {"seq": seq}, ts=100.0)
+        events, gap = log.since("TEST_u", 1, ts=100.0)
+        assert [e["seq"] for e in events] == [4, 5]
+        assert gap
+
+    def test_ttl(self):
+        log = server.WsEventLog(ttl=60)
+        log.append("TEST_u", 1, {"seq": 1}, ts=100.0)
+        log.append("TEST_u", 2, {"seq": 2}, ts=150.0)
+        events, gap = log.since("TEST_u", 0, ts=200.0)
+        assert [e["seq"] for e in events] == [2]
+        assert gap
+        log.prune(ts=300.0)
+        assert "TEST_u" not in log.logs
+
+    def test_gap_when_every_missed_event_expired(self):
+        log = server.WsEventLog(ttl=60)
+        for seq in range(1, 4):
+            log.append("TEST_u", seq, {"seq": seq}, ts=100.0)
+        assert log.since("TEST_u", 1, ts=200.0) == ([], True)
+        assert log.since("TEST_u", 3, ts=200.0) == ([], False)
+        log.prune(ts=300.0)
+        assert log.since("TEST_u", 1, ts=300.0) == ([], False)  # this worker forgot the user
+        assert log.since("TEST_u", 1, ts=300.0, latest_seq=3) == ([], True)
+
+
+def _fixed_seq(seq):
+    async def next_seq(user_id):
+        return seq
+    return next_seq
+
+
+async def _record(bucket, data):
+    bucket.append(data)
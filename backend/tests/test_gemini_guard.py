@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Gemini call guard unit tests: blocking fakes on the dedicated pool (no Gemini, no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+def fail():
+    raise RuntimeError("TEST gemini down")
+
+
+class TestCircuitBreaker:
+    """Opens on a high failure rate, fails fast, one probe closes it again"""
+
+    def test_opens_and_recovers(self):
+        breaker = server.CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=0.05)
+        for ok in (True, False, True, False):
+            assert breaker.allow()
+            breaker.record(ok)
+        assert breaker.state == "open" and not breaker.allow()
+
+        time.sleep(0.06)
+        assert breaker.allow()          # the probe
+        assert not breaker.allow()      # only one at a time
+        breaker.record(True)
+        assert breaker.state == "closed" and breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        breaker = server.CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, open_seconds=0.01)
+        breaker.record(False)
+        breaker.record(False)
+        time.sleep(0.02)
+        assert breaker.allow()
+        breaker.record(False)
+        assert breaker.state == "open" and breaker.opened == 2
+
+
+class TestGeminiExecutor:
+    """Concurrency cap, deadlines and fast failure"""
+
+    def test_concurrency_is_capped(self):
+        executor = server.GeminiExecutor(max_concurrency=2)
+        lock = threading.Lock()
+        state = {"now": 0, "peak": 0}
+
+        def slow_call():
+            with lock:
+                state["now"] += 1
+                state["peak"] = max(state["peak"], state["now"])
+            time.sleep(0.02)
+            with lock:
+                state["now"] -= 1
+            return "ok"
+
+        async def run():
+            calls = [asyncio.create_task(executor.call(slow_call)) for _ in range(6)]
+            await asyncio.sleep(0.005)
+            depth = executor.stats()["queue_depth"]
+            return depth, await asyncio.gather(*calls)
+
+        depth, results = asyncio.run(run())
+        assert results == ["ok"] * 6
+        assert state["peak"] == 2 and depth == 4
+        assert executor.stats()["calls"] == 6
+
+    def test_deadline(self):
+        executor = server.GeminiExecutor(timeout=0.01)
+        with pytest.raises(server.HTTPException) as e:
+            asyncio.run(executor.call(time.sleep, 0.1))
+        assert e.value.status_code == 503
+        assert executor.stats()["timeouts"] == 1
+
+    def test_timed_out_call_keeps_its_slot(self):
+        executor = server.GeminiExecutor(max_concurrency=1, timeout=0.02)
+
+        async def run():
+            with pytest.raises(server.HTTPException):
+                await executor.call(time.sleep, 0.1)
+            assert executor.stats()["in_flight"] == 1  # the thread is still in the SDK
+            # waits for the slot rather than queueing in the pool on its own deadline
+            result = await executor.call(lambda: "ok")
+            return result, executor.stats()
+
+        result, stats = asyncio.run(run())
+        assert result == "ok"
+        assert stats["timeouts"] == 1 and stats["in_flight"] == 0
+
+    def test_open_breaker_fails_fast(self):
+        breaker = server.CircuitBreaker(window=3, min_calls=3, failure_rate=0.5, open_seconds=60)
+        executor = server.GeminiExecutor(breaker=breaker)
+
+        async def run():
+            for _ in range(3):
+                with pytest.raises(server.HTTPException):
+                    await executor.call(fail)
+            started = time.perf_counter()
+            with pytest.raises(server.HTTPException):
+                await executor.call(time.sleep, 1)
+            return time.perf_counter() - started
+
+        assert asyncio.run(run()) < 0.1
+        stats = executor.stats()
+        assert stats["breaker"] == "open" and stats["errors"] == 3 and stats["rejected_open"] == 1
@@ -0,0 +1,83 @@
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# KYC image preprocessing unit tests: synthetic photos, no Gemini, no Mongo
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kyc_images  # noqa: E402
+import server  # noqa: E402
+
+
+def photo(width, height, blur=0, gain=1.0, orientation=None) -> bytes:
+    """Blocky noise (sharp edges everywhere) as a JPEG; optionally blurred, darkened or EXIF-rotated."""
+    blocks = np.random.default_rng(0).integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    img = Image.fromarray(blocks).resize((width, height), Image.NEAREST)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    if gain != 1.0:
+        img = img.point(lambda v: int(v * gain))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95, exif=exif)
+    return out.getvalue()
+
+
+class TestPreprocessImage:
+    """Decode, orient, downscale, re-encode, reject what Gemini could not read"""
+
+    def test_downscales_and_reencodes(self):
+        data = photo(4000, 3000)
+        result = kyc_images.preprocess_image(data, 1600)
+        assert result["usable"] and result["reason"] is None
+        assert (result["width"], result["height"]) == (1600, 1200)
+        assert result["jpeg_bytes"] == len(result["jpeg"]) < len(data)
+        assert Image.open(io.BytesIO(result["jpeg"])).format == "JPEG"
+
+    def test_applies_exif_orientation(self):
+        result = kyc_images.preprocess_image(photo(1200, 800, orientation=6), 1600)  # rotated 90° CW
+        assert (result["width"], result["height"]) == (800, 1200)
+
+    def test_reads_from_path(self, tmp_path):
+        path = tmp_path / "TEST.jpg"
+        path.write_bytes(photo(800, 600))
+        result = kyc_images.preprocess_image(str(path), 1600)
+        assert result["usable"] and result["original_bytes"] == path.stat().st_size
+
+    def test_rejections(self):
+        cases = {
+            "unreadable": b"TEST not an image",
+            "too_small": photo(200, 160),
+            "too_dark": photo(800, 600, gain=0.1),
+            "blurry": photo(800, 600, blur=10),
+        }
+        for reason, data in cases.items():
+            result = kyc_images.preprocess_image(data, 1600)
+            assert not result["usable"] and result["reason"] == reason and result["jpeg"] is None
+            assert reason in server.KYC_IMAGE_REJECTIONS
+
+
+class TestPrepareKycImage:
+    """Process pool round trip"""
+
+    def test_returns_base64_jpeg(self):
+        async def run():
+            try:
+                return await server.prepare_kyc_image(photo(2000, 1500), server.KYC_SELFIE_MAX_SIDE)
+            finally:
+                server._kyc_image_executor().shutdown()
+                server._kyc_image_pool = None
+
+        result = asyncio.run(run())
+        assert result["usable"] and "jpeg" not in result
+        assert Image.open(io.BytesIO(server.base64.b64decode(result["b64"]))).size == (1024, 768)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import httpx
+
+# Push pipeline unit tests: batching, deadlines, retries against a mocked Expo endpoint (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+def fake_expo(batches, fail_first=0):
+    """Mock transport recording each request body; the first `fail_first` requests get a 503."""
+    calls = {"n": 0}
+
+    def handler(request: httpx.Request):
+        calls["n"] += 1
+        if calls["n"] <= fail_first:
+            return httpx.Response(503)
+        body = json.loads(request.content)
+        batches.append(body)
+        return httpx.Response(200, json={"data": [{"status": "ok", "id": str(i)} for i in range(len(body))]})
+    return httpx.MockTransport(handler)
+
+
+def message(i):
+    return {"to": f"ExponentPushToken[TEST_{i}]", "title": "t", "body": "b", "data": {}}
+
+
+class TestBatching:
+    """Flush on size or deadline"""
+
+    def test_full_batches_of_100(self):
+        batches = []
+        sender = server.ExpoPushSender(transport=fake_expo(batches), flush_seconds=5)
+
+        async def run():
+            await sender.start()
+            for i in range(250):
+                sender.enqueue(message(i))
+            await asyncio.sleep(0.05)
+            assert [len(b) for b in batches] == [100, 100]  # the last 50 wait for the deadline
+            await sender.stop()
+
+        asyncio.run(run())
+        assert [len(b) for b in batches] == [100, 100, 50]
+        assert sender.stats["sent"] == 250
+
+    def test_deadline_flushes_partial_batch(self):
+        batches = []
+        sender = server.ExpoPushSender(transport=fake_expo(batches), flush_seconds=0.02)
+
+        async def run():
+            await sender.start()
+            sender.enqueue(message(1))
+            sender.enqueue(message(2))
+            await asyncio.sleep(0.1)
+            result = [len(b) for b in batches]
+            await sender.stop()
+            return result
+
+        assert asyncio.run(run()) == [2]
+
+    def test_queue_is_bounded(self):
+        sender = server.ExpoPushSender(queue_max=3)
+        accepted = [sender.enqueue(message(i)) for i in range(5)]
+        assert accepted == [True, True, True, False, False]
+        assert sender.stats["dropped"] == 2
+
+    def test_enqueue_wait_blocks_until_drained(self):
+        batches = []
+        sender = server.ExpoPushSender(transport=fake_expo(batches), queue_max=3, batch_size=2, flush_seconds=0.01)
+
+        async def run():
+            for i in range(3):
+                sender.enqueue(message(i))
+            waiting = asyncio.create_task(sender.enqueue_wait(message(3)))
+            await asyncio.sleep(0.02)
+            assert not waiting.done()  # full queue, nothing draining it yet
+            await sender.start()
+            await asyncio.wait_for(waiting, 1)
+            await sender.stop()
+
+        asyncio.run(run())
+        assert sender.stats["dropped"] == 0
+        assert sender.stats["sent"] == 4
+
+
+class TestRetries:
+    def test_transient_errors_are_retried(self, monkeypatch):
+        monkeypatch.setattr(server.random, "uniform", lambda a, b: 0)
+        batches = []
+        sender = server.ExpoPushSender(transport=fake_expo(batches, fail_first=2), flush_seconds=0.01)
+
+        async def run():
+            real_sleep = asyncio.sleep
+            monkeypatch.setattr(server.asyncio, "sleep", lambda s: real_sleep(0))
+            await sender.start()
+            sender.enqueue(message(1))
+            await real_sleep(0.1)
+            await sender.stop()
+
+        asyncio.run(run())
+        assert len(batches) == 1
+        assert sender.stats["retries"] == 2
+        assert sender.stats["sent"] == 1
+
+    def test_gives_up_after_max_retries(self, monkeypatch):
+        batches = []
+        sender = server.ExpoPushSender(transport=fake_expo(batches, fail_first=99), max_retries=1)
+
+        async def run():
+            real_sleep = asyncio.sleep
+            monkeypatch.setattr(server.asyncio, "sleep", lambda s: real_sleep(0))
+            await sender.start()
+            sender.enqueue(message(1))
+            await sender.stop()
+
+        asyncio.run(run())
+        assert batches == []
+        assert sender.stats["failed"] == 1
+
+    def test_non_json_body_is_retried(self, monkeypatch):
+        bodies = [httpx.Response(200, text="<html>Bad gateway</html>"),
+                  httpx.Response(200, json={"data": [{"status": "ok", "id": "1"}]})]
+        sender = server.ExpoPushSender(transport=httpx.MockTransport(lambda request: bodies.pop(0)),
+                                       flush_seconds=0.01)
+
+        async def run():
+            real_sleep = asyncio.sleep
+            monkeypatch.setattr(server.asyncio, "sleep", lambda s: real_sleep(0))
+            await sender.start()
+            sender.enqueue(message(1))
+            await sender.stop()
+
+        asyncio.run(run())
+        assert sender.stats["retries"] == 1
+        assert sender.stats["sent"] == 1
+
+
+class TestTickets:
+    def test_error_tickets_are_not_sent(self):
+        tickets = [{"status": "ok", "id": "1"},
+                   {"status": "error", "message": "TEST", "details": {"error": "MessageRateExceeded"}}]
+        sender = server.ExpoPushSender(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"data": tickets})),
+            flush_seconds=0.01,
+        )
+
+        async def run():
+            await sender.start()
+            sender.enqueue(message(1))
+            sender.enqueue(message(2))
+            await sender.stop()
+
+        asyncio.run(run())
+        assert sender.stats["sent"] == 1
+        assert sender.stats["ticket_errors"] == 1
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Rate limiter unit tests: sliding-window counter on the local backend (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+class TestSlidingWindowCounter:
+    """Test RateLimiter with LocalRateLimitStore"""
+
+    def test_allows_up_to_limit_then_blocks(self):
+        """3 hits allowed, 4th blocked"""
+        limiter = server.RateLimiter(server.LocalRateLimitStore(), local_cache=False)
+
+        async def run():
+            return [await limiter.hit("otp_send", "+919000000001", 3, 600) for _ in range(4)]
+
+        assert asyncio.run(run()) == [False, False, False, True]
+
+    def test_rejected_hits_do_not_consume_quota(self):
+        """Blocked attempts are never counted on the shared counter"""
+        store = server.LocalRateLimitStore()
+        limiter = server.RateLimiter(store, local_cache=False)
+
+        async def run():
+            for _ in range(6):
+                await limiter.hit("recharge", "TEST_user", 3, 600)
+
+        asyncio.run(run())
+        buckets = store._counters["recharge:TEST_user"]
+        assert sum(buckets.values()) == 3
+
+    def test_keys_are_independent(self):
+        """Different keys and limit types have separate counters"""
+        limiter = server.RateLimiter(server.LocalRateLimitStore(), local_cache=False)
+
+        async def run():
+            await limiter.hit("otp_send", "a", 1, 600)
+            return (
+                await limiter.hit("otp_send", "a", 1, 600),
+                await limiter.hit("otp_send", "b", 1, 600),
+                await limiter.hit("recharge", "a", 1, 600),
+            )
+
+        assert asyncio.run(run()) == (True, False, False)
+
+
+class TestLocalTokenBucket:
+    """Test the in-process front cache"""
+
+    def test_front_cache_rejects_without_store_round_trip(self):
+        """Once local tokens are spent, the store is not touched"""
+        calls = []
+
+        class CountingStore(server.LocalRateLimitStore):
+            async def acquire(self, *args):
+                calls.append(args)
+                return await super().acquire(*args)
+
+        limiter = server.RateLimiter(CountingStore(), local_cache=True)
+
+        async def run():
+            return [await limiter.hit("otp_send", "hot", 2, 600) for _ in range(5)]
+
+        assert asyncio.run(run()) == [False, False, True, True, True]
+        assert len(calls) == 2
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Vision backend unit tests: the local fake behind the real KYC helpers (no Gemini, no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+class NoCache(server.VisionResultCache):
+    async def get(self, key):
+        return None
+
+    async def put(self, key, kind, result, ttl=None):
+        pass
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    def install(**options):
+        backend = server.FakeVisionBackend(**options)
+        monkeypatch.setattr(server, "vision_backend", backend)
+        monkeypatch.setattr(server, "vision_cache", NoCache())
+        monkeypatch.setattr(server, "gemini_executor", server.GeminiExecutor())
+        return backend
+    return install
+
+
+class TestFakeVisionBackend:
+    """Deterministic answers that drive the KYC helpers to a verified result"""
+
+    def test_pipeline_verifies(self, fake_backend):
+        fake_backend()
+
+        async def run():
+            ocr = await server.gemini_ocr_extraction("pan", "TEST id")
+            face, match = await server.gemini_face_checks("TEST id", "TEST selfie")
+            return ocr, face, match
+
+        ocr, face, match = asyncio.run(run())
+        assert ocr["ocr_status"] == "success"
+        age = server.check_age_18_plus(ocr["extracted_dob"])
+        assert server.determine_kyc_result(ocr, age, face, match)["status"] == "verified"
+
+    def test_same_images_same_answer(self):
+        answer = server.FakeVisionBackend.answer
+        assert answer("ocr", ["TEST a"]) == answer("ocr", ["TEST a"])
+        assert answer("ocr", ["TEST a"]) != answer("ocr", ["TEST b"])
+
+    def test_latency_and_failure_rate(self, fake_backend):
+        backend = fake_backend(latency_ms=20, failure_rate=0.5, seed=7)
+
+        async def run():
+            results = await asyncio.gather(
+                *(server._gemini_json("liveness", "TEST prompt", [f"img{i}"]) for i in range(20)),
+                return_exceptions=True,
+            )
+            return [r for r in results if isinstance(r, server.HTTPException)]
+
+        started = time.perf_counter()
+        failures = asyncio.run(run())
+        assert time.perf_counter() - started >= 0.02
+        assert backend.calls + server.gemini_executor.counts["rejected_open"] == 20
+        assert 0 < len(failures) < 20
+
+
+class TestMakeVisionBackend:
+    """The fake approves everything, so it has to be asked for explicitly"""
+
+    def test_fake_needs_opt_in(self):
+        with pytest.raises(ValueError):
+            server.make_vision_backend("fake", allow_fake=False)
+        assert isinstance(server.make_vision_backend("fake", allow_fake=True), server.FakeVisionBackend)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            server.make_vision_backend("TEST-unknown")
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Vision result cache unit tests: scripted vision backend and an in-memory vision_cache collection (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+class FakeCollection:
+    """find_one / update_one on {"key": ...} documents, honouring the expires_at filter."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query["key"])
+        if doc and doc["expires_at"] > query["expires_at"]["$gt"]:
+            return dict(doc)
+        return None
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs[query["key"]] = {"key": query["key"], **update["$set"]}
+
+
+class FakeDB:
+    def __init__(self):
+        self.vision_cache = FakeCollection()
+
+
+class ScriptedBackend:
+    model_name = "TEST-backend"
+    available = True
+
+    def __init__(self, text='```json\n{"is_valid_document": true, "confidence": 0.9}\n```'):
+        self.text = text
+        self.calls = 0
+
+    def generate(self, kind, prompt, images):
+        self.calls += 1
+        return self.text
+
+
+def with_fakes(monkeypatch, backend=None, cache=None):
+    backend = backend or ScriptedBackend()
+    monkeypatch.setattr(server, "db", FakeDB())
+    monkeypatch.setattr(server, "vision_backend", backend)
+    monkeypatch.setattr(server, "vision_cache", cache or server.VisionResultCache())
+    return backend
+
+
+class TestVisionCacheKey:
+    """Same prompt and images → same key; anything else → a new key"""
+
+    def test_key_inputs(self):
+        key = server.VisionResultCache.key
+        assert key("m", "TEST prompt", ["a", "b"]) == key("m", "TEST prompt", ["a", "b"])
+        assert key("m", "TEST prompt", ["a", "b"]) != key("m", "TEST prompt v2", ["a", "b"])
+        assert key("m", "TEST prompt", ["a", "b"]) != key("m", "TEST prompt", ["b", "a"])
+        assert key("m", "TEST prompt", ["a"]) != key("m", "TEST prompt", ["ab"])
+        assert key("m", "TEST prompt", ["a"]) != key("other-backend", "TEST prompt", ["a"])
+
+
+class TestGeminiJson:
+    """Repeat calls are answered without a remote call"""
+
+    def test_repeat_is_cached(self, monkeypatch):
+        backend = with_fakes(monkeypatch)
+
+        async def run():
+            first = await server._gemini_json("ocr", "TEST prompt", ["img"])
+            first["confidence"] = 0.0  # callers get copies
+            return first, await server._gemini_json("ocr", "TEST prompt", ["img"])
+
+        first, second = asyncio.run(run())
+        assert backend.calls == 1
+        assert second == {"is_valid_document": True, "confidence": 0.9}
+        assert server.vision_cache.stats["memory_hits"] == 1
+
+    def test_shared_collection_serves_other_workers(self, monkeypatch):
+        backend = with_fakes(monkeypatch)
+        asyncio.run(server._gemini_json("ocr", "TEST prompt", ["img"]))
+        monkeypatch.setattr(server, "vision_cache", server.VisionResultCache())  # another worker's empty LRU
+        asyncio.run(server._gemini_json("ocr", "TEST prompt", ["img"]))
+        assert backend.calls == 1
+        assert server.vision_cache.stats["db_hits"] == 1
+
+    def test_expired_and_unparseable_are_not_served(self, monkeypatch):
+        backend = with_fakes(monkeypatch, cache=server.VisionResultCache(ttl=-1))
+        asyncio.run(server._gemini_json("ocr", "TEST prompt", ["img"]))
+        asyncio.run(server._gemini_json("ocr", "TEST prompt", ["img"]))
+        assert backend.calls == 2
+
+        backend = with_fakes(monkeypatch, backend=ScriptedBackend(text="not json"))
+        for _ in range(2):
+            try:
+                asyncio.run(server._gemini_json("ocr", "TEST prompt", ["img"]))
+            except ValueError:
+                pass
+        assert backend.calls == 2
+
+    def test_lru_is_bounded(self, monkeypatch):
+        with_fakes(monkeypatch, cache=server.VisionResultCache(max_entries=2))
+        for image in ("a", "b", "c"):
+            asyncio.run(server._gemini_json("ocr", "TEST prompt", [image]))
+        assert len(server.vision_cache._lru) == 2
+
+
+class PromptAwareBackend(ScriptedBackend):
+    """Answers each prompt kind; the combined answer can be made incomplete."""
+
+    def __init__(self, combined='{"face_detected": true, "is_live_person": true, "liveness_score": 0.9, '
+                                '"is_match": true, "match_score": 0.8}'):
+        super().__init__()
+        self.combined = combined
+        self.prompts = []
+
+    def generate(self, kind, prompt, images):
+        self.prompts.append(prompt)
+        if "performing two checks" in prompt:
+            self.text = self.combined
+        elif "liveness" in prompt:
+            self.text = '{"face_detected": true, "is_live_person": true, "liveness_score": 0.9}'
+        else:
+            self.text = '{"is_match": true, "match_score": 0.8}'
+        return super().generate(kind, prompt, images)
+
+
+class TestFaceChecks:
+    """One combined call, two separate calls as the fallback"""
+
+    def test_combined_single_call(self, monkeypatch):
+        backend = with_fakes(monkeypatch, backend=PromptAwareBackend())
+        face, match = asyncio.run(server.gemini_face_checks("TEST id", "TEST selfie"))
+        assert backend.calls == 1
+        assert face["liveness_status"] == "passed" and match["match_status"] == "matched"
+        assert set(face) == set(server._liveness_fields({})) and set(match) == set(server._face_match_fields({}))
+
+    def test_incomplete_answer_falls_back(self, monkeypatch):
+        backend = with_fakes(monkeypatch, backend=PromptAwareBackend(combined='{"liveness_score": 0.9}'))
+        face, match = asyncio.run(server.gemini_face_checks("TEST id", "TEST selfie"))
+        assert backend.calls == 3
+        assert face["liveness_score"] == 0.9 and match["match_score"] == 0.8
+        asyncio.run(server.gemini_face_checks("TEST id", "TEST selfie"))
+        assert backend.calls == 4  # the incomplete combined answer was not cached; the separate ones were
+
+
+class TestVerdictTtl:
+    """Passing answers are cached for the full TTL, negative ones briefly, incomplete ones not at all"""
+
+    def test_ttl_by_verdict(self, monkeypatch):
+        answers = {
+            "TEST pass": '{"is_valid_document": true, "extracted_name": "A", "extracted_dob": "1990-01-01"}',
+            "TEST negative": '{"is_valid_document": false}',
+            "TEST incomplete": '{"is_valid_document": true}',
+        }
+        with_fakes(monkeypatch)
+        ttls = {}
+        for image, text in answers.items():
+            monkeypatch.setattr(server, "vision_backend", ScriptedBackend(text))
+            asyncio.run(server.gemini_ocr_extraction("pan", image))
+            doc = next((d for d in server.db.vision_cache.docs.values() if d["kind"] == "ocr"), None)
+            ttls[image] = doc and (doc["expires_at"] - server.datetime.now(server.timezone.utc)).total_seconds()
+            server.db.vision_cache.docs.clear()
+        assert ttls["TEST pass"] > server.VISION_CACHE_TTL_SECONDS - 60
+        assert 0 < ttls["TEST negative"] <= server.VISION_CACHE_NEGATIVE_TTL_SECONDS
+        assert ttls["TEST incomplete"] is None
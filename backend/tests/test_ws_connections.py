@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Connection manager unit tests: multi-device sessions, send queues, slow-consumer eviction (no server, no Mongo)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+class TestMultiDevice:
+    """Several connections per user, each gets every event"""
+
+    def test_event_reaches_every_device(self):
+        manager = server.ConnectionManager()
+        phone, tablet = FakeSocket(), FakeSocket()
+
+        async def run():
+            manager.register("TEST_u", phone)
+            manager.register("TEST_u", tablet)
+            assert manager.send("TEST_u", {"event": "incoming_call"}) == 2
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert phone.sent == tablet.sent == ['{"event":"incoming_call"}']
+
+    def test_unregister_keeps_other_devices(self):
+        manager = server.ConnectionManager()
+
+        async def run():
+            first = manager.register("TEST_u", FakeSocket())
+            manager.register("TEST_u", FakeSocket())
+            manager.unregister(first)
+            assert manager.is_connected("TEST_u")
+            assert manager.stats()["connections"] == 1
+
+        asyncio.run(run())
+
+
+class TestBackpressure:
+    """Pushes never wait on a socket; slow consumers are evicted"""
+
+    def test_send_does_not_block_on_slow_socket(self):
+        manager = server.ConnectionManager()
+        slow = FakeSocket(delay=1.0)
+
+        async def run():
+            manager.register("TEST_u", slow)
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            for i in range(5):
+                manager.send("TEST_u", {"n": i})
+            return loop.time() - started
+
+        assert asyncio.run(run()) < 0.05
+
+    def test_full_queue_evicts(self):
+        manager = server.ConnectionManager()
+        slow, fast = FakeSocket(delay=1.0), FakeSocket()
+
+        async def run():
+            conn = manager.register("TEST_u", slow)
+            conn.queue = asyncio.Queue(maxsize=2)
+            manager.register("TEST_u", fast)
+            for i in range(4):
+                manager.send("TEST_u", {"n": i})
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert slow.closed_with == 4008
+        assert manager.evictions == 1
+        assert len(fast.sent) == 4
+        assert manager.stats()["connections"] == 1
+
+    def test_stalled_send_evicts(self):
+        manager = server.ConnectionManager()
+        stalled = FakeSocket(delay=1.0)
+
+        async def run():
+            conn = manager.register("TEST_u", stalled)
+            conn.send_timeout = 0.01
+            manager.send("TEST_u", {"n": 1})
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        assert stalled.closed_with == 4008
+        assert not manager.is_connected("TEST_u")
+
+
+class TestReplayBacklog:
+    """A reconnect replay is not limited by the send queue"""
+
+    def test_replay_longer_than_queue(self):
+        manager = server.ConnectionManager()
+        log = server.WsEventLog()
+        socket = FakeSocket()
+        count = server.WS_SEND_QUEUE_MAX + 16
+        for seq in range(1, count + 1):
+            log.append("TEST_u", seq, {"event": "incoming_call", "seq": seq})
+
+        async def run():
+            missed, gap = log.since("TEST_u", 0)
+            manager.register("TEST_u", socket, backlog=[server.orjson.dumps(e).decode() for e in missed])
+            manager.send("TEST_u", {"event": "live"})
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        assert socket.closed_with is None and manager.evictions == 0
+        assert len(socket.sent) == count + 1
+        assert socket.sent[-1] == '{"event":"live"}'
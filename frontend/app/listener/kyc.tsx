@@ -30,6 +30,17 @@ interface FinalResult {
   message: string;
 }
 
+// Uploads return a job id; verification runs on the server and is polled via /kyc/status
+const waitForKycJob = async (jobId: string) => {
+  for (let i = 0; i < 120; i++) {
+    const res = await api.get(`/kyc/status?job_id=${jobId}`);
+    if (res.job?.status === 'done') return res.job.result;
+    if (res.job?.status === 'failed') throw new Error(res.job.error || 'Verification failed');
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+  }
+  throw new Error('Verification is taking longer than expected. Please check back shortly.');
+};
+
 export default function KYCScreen() {
   const router = useRouter();
   const [step, setStep] = useState<KYCStep>('start');
@@ -148,10 +159,11 @@ export default function KYCScreen() {
     
     setProcessing(true);
     try {
-      const res = await api.post('/kyc/upload-id', {
+      const job = await api.post('/v2/kyc/upload-id', {
         id_type: idType,
         id_image_base64: idImage,
       });
+      const res = await waitForKycJob(job.job_id);
       
       if (res.success) {
         setExtractedData(res.extracted_data);
@@ -195,9 +207,10 @@ export default function KYCScreen() {
     setProcessing(true);
     
     try {
-      const res = await api.post('/kyc/upload-selfie', {
+      const job = await api.post('/v2/kyc/upload-selfie', {
         video_base64: selfieImage,
       });
+      const res = await waitForKycJob(job.job_id);
 
       // Wait for animation then show result
       setTimeout(() => {